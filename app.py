@@ -2,20 +2,33 @@
 # Multimodal Smart-Agri Copilot (Nongsaro Middle Category All Number Removal)
 
 import base64
+import csv
 import json
 import math
 import datetime as dt
 import os
-from typing import List, Optional, Dict, Tuple
+import time
+import hashlib
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Tuple, NamedTuple, Callable, Hashable
 import xml.etree.ElementTree as ET # XML 파싱을 위해 추가
 import urllib.parse # urllib.parse 모듈 임포트 추가
 import re # 정규 표현식을 위해 추가
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import streamlit as st
 from PIL import Image
 from streamlit_geolocation import streamlit_geolocation
 
+from nongsaro_xml import (
+    NongsaroMainCategory, NongsaroMiddleCategory, NongsaroVariety, NongsaroPage,
+    clean_category_name, charset_from_content_type, parse_nongsaro_xml,
+)
+
 
 # --- Secrets 로드 (Streamlit 환경 및 로컬 테스트 환경 모두에서 동작하도록 개선) ---
 def get_secret(key: str, default: str = "") -> str:
@@ -82,6 +95,66 @@ except Exception:
     def tr_ko(text: str) -> str: return text or ""
     _HAS_TR = False
 
+# ---------------------- Spatial Index ----------------------
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """두 좌표 사이의 대원 거리(km)를 계산합니다."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dl/2)**2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+class LatLonGridIndex:
+    """
+    lat/lon 필드를 가진 레코드(관측지점, 시군구청 위치 등)를 cell_deg 크기의 위경도 격자 버킷으로 나눈 공간 인덱스입니다.
+    질의 좌표의 칸부터 바깥 고리(ring) 순서로 탐색하며, 남은 고리가 현재 k번째 후보보다
+    가까울 수 없으면 즉시 멈춥니다.
+    """
+    __slots__ = ("cell_deg", "buckets", "bounds")
+
+    def __init__(self, records: list, cell_deg: float = 0.25):
+        self.cell_deg = cell_deg
+        self.buckets: Dict[Tuple[int, int], list] = {}
+        for s in records:
+            self.buckets.setdefault(self._cell(s.lat, s.lon), []).append(s)
+        rows = [c[0] for c in self.buckets] or [0]
+        cols = [c[1] for c in self.buckets] or [0]
+        self.bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self.buckets.values())
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[float, NamedTuple]]:
+        """(거리 km, 레코드) 목록을 가까운 순으로 최대 k개 반환합니다."""
+        if not self.buckets or k <= 0:
+            return []
+        ci, cj = self._cell(lat, lon)
+        r0, r1, c0, c1 = self.bounds
+        max_ring = max(abs(ci - r0), abs(ci - r1), abs(cj - c0), abs(cj - c1))
+        coslat = math.cos(math.radians(lat))
+        best: List[Tuple[float, NamedTuple]] = [] # (등장방형 근사 거리², 레코드)
+
+        for ring in range(max_ring + 1):
+            for i in range(ci - ring, ci + ring + 1):
+                edge = i in (ci - ring, ci + ring)
+                js = range(cj - ring, cj + ring + 1) if edge else (cj - ring, cj + ring)
+                for j in js:
+                    for s in self.buckets.get((i, j), ()):
+                        dy = s.lat - lat
+                        dx = (s.lon - lon) * coslat
+                        best.append((dx*dx + dy*dy, s))
+            if len(best) >= k:
+                best.sort(key=lambda x: x[0])
+                del best[k:]
+                # 아직 보지 않은 칸은 위도/경도 중 하나가 ring*cell_deg 이상 떨어져 있음
+                bound = ring * self.cell_deg * coslat
+                if best[-1][0] <= bound * bound:
+                    break
+        best.sort(key=lambda x: x[0])
+        return [(haversine_km(lat, lon, s.lat, s.lon), s) for _, s in best[:k]]
+
 # ---------------------- Geolocation (IP 기반) ----------------------
 @st.cache_data(ttl=3600*24) # 24시간 캐싱
 def get_user_ip_geolocation():
@@ -99,6 +172,299 @@ def get_user_ip_geolocation():
         st.error(f"IP 기반 위치 정보 요청 오류: {e}. 기본 위치를 사용합니다.")
         return None, None, None
 
+# ---------------------- Location (오프라인 역지오코딩) ----------------------
+# 번들된 시군구청 위치 표(data/sigungu_offices.csv)로 좌표 → 행정구역을 네트워크 없이 찾습니다.
+# 좌표는 행정구역의 중심점이 아니라 시·군·구청 소재지(섬 지역 등 일부 군은 대략의 위치)이며,
+# 가장 가까운 청사의 시군구를 돌려주는 근사 방식이라 경계 부근에서는 이웃 시군구로 잡힐 수 있습니다.
+# 광역시는 자치구·군 단위로, 세종특별자치시는 시 단위로 수록되어 있습니다.
+SIGUNGU_OFFICES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sigungu_offices.csv")
+REGION_MAX_DISTANCE_KM = 60.0 # 가장 가까운 청사가 이보다 멀면 (해상/국외) 지역 미상으로 처리
+
+class SigunguRegion(NamedTuple):
+    sido: str
+    sigungu: str
+    lat: float
+    lon: float
+
+    @property
+    def name(self) -> str:
+        return f"{self.sido} {self.sigungu}".strip()
+
+class LocationInfo(NamedTuple):
+    lat: float
+    lon: float
+    region: Optional[SigunguRegion]
+    region_distance_km: Optional[float]
+    nx: int # KMA 격자 X
+    ny: int # KMA 격자 Y
+
+    @property
+    def city_name(self) -> str:
+        return self.region.name if self.region else "알 수 없음"
+
+@st.cache_resource(show_spinner=False) # 모든 세션이 공유
+def get_sigungu_index() -> LatLonGridIndex:
+    """시군구청 위치 표를 읽어 공간 인덱스를 만듭니다."""
+    with open(SIGUNGU_OFFICES_PATH, 'r', encoding='utf-8', newline='') as f:
+        regions = [SigunguRegion(row["sido"], row["sigungu"], float(row["lat"]), float(row["lon"]))
+                   for row in csv.DictReader(f)]
+    return LatLonGridIndex(regions, cell_deg=0.5)
+
+def reverse_geocode(lat: float, lon: float) -> Tuple[Optional[SigunguRegion], Optional[float]]:
+    """좌표에서 가장 가까운 청사의 시군구와 그 청사까지의 거리(km)를 반환합니다."""
+    try:
+        nearest = get_sigungu_index().nearest(lat, lon, k=1)
+    except (OSError, ValueError, KeyError) as e:
+        st.warning(f"시군구청 위치 표를 읽지 못했습니다: {e}")
+        return None, None
+    if not nearest or nearest[0][0] > REGION_MAX_DISTANCE_KM:
+        return None, None
+    distance_km, region = nearest[0]
+    return region, distance_km
+
+def resolve_location(lat: float, lon: float) -> LocationInfo:
+    """
+    좌표를 시군구와 KMA 격자로 변환합니다.
+    같은 좌표는 세션(st.session_state)에 저장된 결과를 재사용하므로 재실행마다 다시 계산하지 않습니다.
+    """
+    key = (round(lat, 5), round(lon, 5))
+    cached = st.session_state.get("resolved_location")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    nx, ny = latlon_to_grid(lat, lon)
+    region, distance_km = reverse_geocode(lat, lon)
+    loc = LocationInfo(lat, lon, region, distance_km, nx, ny)
+    st.session_state.resolved_location = (key, loc)
+    return loc
+
+# ---------------------- Cross-session Coordination ----------------------
+# Streamlit은 모든 세션을 한 프로세스의 스레드로 실행하므로, st.cache_resource로 공유한 Coordinator가
+# 세션 간 업스트림 호출을 조율합니다.
+#  - singleflight: 같은 키로 진행 중인 호출이 있으면 새로 요청하지 않고 그 결과를 함께 받습니다.
+#  - 토큰 버킷: 업스트림별 호출 한도와 사용자별 질문 빈도를 제한합니다.
+#  - 공정 대기열: OpenAI 동시 호출 슬롯을 사용자별 라운드로빈으로 배분합니다.
+UPSTREAM_LIMITS = { # 업스트림: (초당 토큰, 최대 버스트)
+    "kma": (10, 20),
+    "nongsaro": (10, 20),
+    "rda": (5, 10),
+    "plantid": (1, 3),
+    "openai": (3, 6),
+}
+UPSTREAM_WAIT_SEC = 10      # 업스트림 토큰 대기 최대 시간
+USER_RATE_LIMIT = (0.1, 3)  # 사용자당 (초당 토큰, 최대 버스트): 10초에 1회, 연속 3회까지
+OPENAI_MAX_CONCURRENCY = 4  # OpenAI 동시 호출 수
+OPENAI_QUEUE_WAIT_SEC = 60  # OpenAI 대기열 최대 대기 시간
+USER_BUCKET_SWEEP_AT = 1000 # 사용자 버킷이 이 수를 넘으면 유휴 버킷 정리
+USER_BUCKET_SWEEP_SEC = 60  # 유휴 버킷 정리 최소 간격
+# 앱 앞단에서 X-Forwarded-For에 주소를 덧붙이는 신뢰 프록시 수. 0이면 헤더를 보지 않습니다
+# (프록시 없이 노출된 경우 클라이언트가 헤더를 마음대로 보낼 수 있으므로).
+try:
+    TRUSTED_PROXY_HOPS = max(0, int(get_secret("TRUSTED_PROXY_HOPS", "0") or 0))
+except ValueError:
+    TRUSTED_PROXY_HOPS = 0
+
+class UpstreamRateLimited(requests.exceptions.RequestException):
+    """업스트림 호출 한도나 대기열 슬롯을 대기 시간 안에 얻지 못한 경우 발생합니다."""
+
+class TokenBucket:
+    """초당 rate개씩 채워지고 최대 capacity개까지 쌓이는 토큰 버킷입니다."""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "lock")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """토큰을 얻으면 0, 못 얻으면 다음 토큰까지 남은 초를 반환합니다."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout: float) -> bool:
+        """최대 timeout초 동안 기다리며 토큰을 얻습니다."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(wait, remaining))
+
+class _InflightCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 호출을 하나로 합칩니다. 먼저 온 호출(리더)만 실제로 실행됩니다."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _InflightCall] = {}
+
+    def do(self, key: Hashable, fn: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InflightCall()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class FairQueue:
+    """
+    동시 실행 슬롯을 사용자별 대기열에 라운드로빈으로 배분합니다.
+    한 사용자가 요청을 여러 개 쌓아도 다른 사용자의 요청이 그 뒤에 밀리지 않습니다.
+    """
+
+    def __init__(self, slots: int):
+        self._cond = threading.Condition()
+        self._free = slots
+        self._waiting: Dict[str, deque] = {} # 사용자 → 대기 중인 티켓
+        self._turns: deque = deque()         # 대기 중인 사용자의 라운드로빈 순서
+
+    def _dispatch(self) -> None:
+        while self._free > 0 and self._turns:
+            user_id = self._turns.popleft()
+            tickets = self._waiting[user_id]
+            tickets.popleft()[0] = True
+            self._free -= 1
+            if tickets:
+                self._turns.append(user_id) # 남은 요청은 다른 사용자들 뒤로
+            else:
+                del self._waiting[user_id]
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user_id: str, timeout: float):
+        ticket = [False] # 슬롯 배정 여부
+        with self._cond:
+            if user_id not in self._waiting:
+                self._waiting[user_id] = deque()
+                self._turns.append(user_id)
+            self._waiting[user_id].append(ticket)
+            self._dispatch()
+            if not self._cond.wait_for(lambda: ticket[0], timeout):
+                tickets = self._waiting[user_id]
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._waiting[user_id]
+                    self._turns.remove(user_id)
+                raise UpstreamRateLimited("OpenAI 대기열 대기 시간 초과")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._free += 1
+                self._dispatch()
+
+class Coordinator:
+    """세션 간에 공유되는 singleflight, 토큰 버킷, OpenAI 공정 대기열 묶음입니다."""
+
+    def __init__(self):
+        self.singleflight = SingleFlight()
+        self.upstreams = {name: TokenBucket(*limit) for name, limit in UPSTREAM_LIMITS.items()}
+        self.openai_queue = FairQueue(OPENAI_MAX_CONCURRENCY)
+        self._users: Dict[str, TokenBucket] = {}
+        self._users_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _sweep_idle_users(self, now: float) -> None:
+        """
+        가득 찰 만큼 오래 쓰이지 않은 사용자 버킷을 지웁니다.
+        다시 만들어도 새 버킷과 상태가 같으므로 다른 사용자의 한도에는 영향이 없습니다.
+        """
+        rate, capacity = USER_RATE_LIMIT
+        refill_sec = capacity / rate
+        idle = [uid for uid, b in self._users.items() if now - b.updated >= refill_sec]
+        for uid in idle:
+            del self._users[uid]
+        self._last_sweep = now
+
+    def allow_user(self, user_id: str) -> bool:
+        """사용자별 질문 빈도 한도 안이면 True를 반환합니다."""
+        with self._users_lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                now = time.monotonic()
+                if len(self._users) >= USER_BUCKET_SWEEP_AT and now - self._last_sweep >= USER_BUCKET_SWEEP_SEC:
+                    self._sweep_idle_users(now)
+                bucket = self._users[user_id] = TokenBucket(*USER_RATE_LIMIT)
+        return bucket.try_acquire() == 0.0
+
+    def call(self, upstream: str, key: Hashable, fn: Callable):
+        """
+        (upstream, key)로 진행 중인 호출이 있으면 그 결과를 공유하고,
+        없으면 업스트림 토큰을 얻은 뒤 fn을 실행합니다.
+        """
+        def run():
+            if not self.upstreams[upstream].acquire(UPSTREAM_WAIT_SEC):
+                raise UpstreamRateLimited(f"{upstream} 호출 한도 초과. 잠시 후 다시 시도하세요.")
+            return fn()
+        return self.singleflight.do((upstream, key), run)
+
+@st.cache_resource(show_spinner=False) # 모든 세션이 공유
+def get_coordinator() -> Coordinator:
+    return Coordinator()
+
+def _client_ip() -> Optional[str]:
+    """
+    클라이언트 IP를 구합니다.
+    TRUSTED_PROXY_HOPS가 설정된 경우에만 X-Forwarded-For를 보며, 클라이언트가 임의로 넣을 수 있는
+    왼쪽 항목 대신 신뢰 프록시가 덧붙인 오른쪽에서 TRUSTED_PROXY_HOPS번째 주소를 씁니다.
+    그 밖에는 Streamlit이 본 연결 주소(st.context.ip_address)를 씁니다.
+    """
+    try:
+        if TRUSTED_PROXY_HOPS:
+            hops = [h.strip() for h in st.context.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+            # 항목이 hop 수보다 적으면 프록시 체인을 거치지 않은 요청이므로 믿지 않습니다.
+            return hops[-TRUSTED_PROXY_HOPS] if len(hops) >= TRUSTED_PROXY_HOPS else None
+        return getattr(st.context, "ip_address", None)
+    except AttributeError: # st.context가 없는 구버전 Streamlit
+        return None
+
+def current_user_id() -> str:
+    """
+    레이트 리밋/공정 대기열에 쓰는 사용자 식별자를 반환합니다.
+    새로고침이나 새 탭에도 유지되도록 클라이언트 IP를 쓰고, 구할 수 없으면 세션별 ID로 대체합니다.
+    IP 기준이므로 NAT·사내망처럼 주소를 공유하는 사용자는 한도를 함께 쓰고,
+    세션 ID로 대체된 경우에는 새 세션을 열 때마다 한도가 초기화됩니다.
+    """
+    if "user_id" not in st.session_state:
+        ip = _client_ip()
+        st.session_state.user_id = f"ip:{ip}" if ip else f"session:{uuid.uuid4().hex}"
+    return st.session_state.user_id
+
+def request_key(url: str, params: Optional[dict] = None) -> Tuple:
+    """URL과 파라미터로 singleflight 키를 만듭니다."""
+    return (url, tuple(sorted((params or {}).items())))
+
 # ---------------------- KMA API Session (HTTP 우선) ----------------------
 def kma_get(url: str, params: dict, timeout: tuple = (5, 20)) -> Optional[requests.Response]:
     """
@@ -111,10 +477,14 @@ def kma_get(url: str, params: dict, timeout: tuple = (5, 20)) -> Optional[reques
     else:
         http_url = url
     
-    try:
+    def fetch() -> requests.Response:
         r = requests.get(http_url, params=params, headers=headers, timeout=timeout)
         r.raise_for_status()
         return r
+
+    try:
+        # 같은 격자/시각을 동시에 요청한 세션들은 한 번의 호출 결과를 공유
+        return get_coordinator().call("kma", request_key(http_url, params), fetch)
     except requests.exceptions.RequestException as e:
         st.error(f"KMA API 호출 중 오류 발생: {e}") # 오류 발생 시만 출력
         return None
@@ -139,12 +509,12 @@ def latlon_to_grid(lat, lon):
     x=ra*math.sin(theta)+XO; y=ro-ra*math.cos(theta)+YO
     return int(x+1.5), int(y+1.5)
 
-def kma_ultra_now(lat: float, lon: float) -> Optional[dict]:
+def kma_ultra_now(lat: float, lon: float, grid: Optional[Tuple[int, int]] = None) -> Optional[dict]:
     """기상청 초단기 실황 정보를 가져옵니다 (T1H, REH, RN1)."""
     if not KMA_API_KEY:
         st.error("KMA_API_KEY가 설정되지 않았습니다. .streamlit/secrets.toml을 확인하세요.")
         return None
-    nx, ny = latlon_to_grid(lat, lon)
+    nx, ny = grid or latlon_to_grid(lat, lon)
     kst = dt.datetime.now(dt.timezone.utc) + dt.timedelta(hours=9)
     base_dt = kst - dt.timedelta(minutes=45)
     base_date = base_dt.strftime("%Y%m%d")
@@ -177,12 +547,12 @@ def _latest_vilage_base_time(kst: dt.datetime)->str:
     hh=kst.hour
     base=max([h for h in slots if h<=hh] or [23]); return f"{base:02d}00"
 
-def kma_vilage_pop(lat: float, lon: float) -> Optional[dict]:
+def kma_vilage_pop(lat: float, lon: float, grid: Optional[Tuple[int, int]] = None) -> Optional[dict]:
     """기상청 단기 예보의 강수 확률(POP)을 가져옵니다."""
     if not KMA_API_KEY:
         st.error("KMA_API_KEY가 설정되지 않았습니다. .streamlit/secrets.toml을 확인하세요.")
         return None
-    nx, ny = latlon_to_grid(lat, lon)
+    nx, ny = grid or latlon_to_grid(lat, lon)
     kst = dt.datetime.now(dt.timezone.utc) + dt.timedelta(hours=9)
     base_date = kst.strftime("%Y%m%d"); base_time = _latest_vilage_base_time(kst)
     
@@ -246,13 +616,30 @@ def plantid_identify(image_bytes: bytes) -> Optional[dict]:
         "disease_details": ["common_names", "description", "url", "treatment"],
         "modifiers": ["similar_images"]
     }
-    try:
+    def fetch() -> dict:
         r = requests.post(url, headers=headers, json=payload, timeout=(8, 30))
         r.raise_for_status(); return r.json()
+
+    try:
+        return get_coordinator().call("plantid", hashlib.sha1(image_bytes).hexdigest(), fetch)
     except requests.exceptions.RequestException as e:
         st.error(f"Plant.ID API 호출 오류: {e}")
         return None
 
+# --- NongsaRo XML 스트리밍 조회 (파서와 레코드 타입은 nongsaro_xml.py) ---
+def nongsaro_get_page(url: str, params: dict, record_type, coordinator: Optional[Coordinator] = None) -> NongsaroPage:
+    """
+    농사로 API를 스트리밍 모드로 호출하고 응답을 parse_nongsaro_xml로 파싱합니다.
+    작업 스레드에서 호출할 때는 스크립트 스레드에서 얻은 coordinator를 넘겨줍니다.
+    """
+    def fetch() -> NongsaroPage:
+        with requests.get(url, params=params, timeout=(5, 15), stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True # gzip 등 전송 인코딩을 투명하게 해제
+            return parse_nongsaro_xml(r.raw, record_type, charset_from_content_type(r.headers.get("Content-Type")))
+
+    return (coordinator or get_coordinator()).call("nongsaro", request_key(url, params), fetch)
+
 # --- NongsaRo Category Data & Fetching Functions ---
 # 품목 카테고리 정보 캐싱 (메인/미들 카테고리 목록을 가져오는 함수)
 @st.cache_data(ttl=3600*24*7) # 1주간 캐싱
@@ -263,19 +650,12 @@ def get_nongsaro_main_categories() -> List[Tuple[str, str]]:
     params = {"apiKey": NONGSARO_API_KEY}
     
     try:
-        r = requests.get(url, params=params, timeout=(5, 15))
-        r.raise_for_status()
-        xml_text = r.text
-        root = ET.fromstring(xml_text)
+        page = nongsaro_get_page(url, params, NongsaroMainCategory)
         
         main_categories = [("선택하세요", "")] # 초기 선택 옵션
-        items_tag = root.find('.//items')
-        if items_tag is not None:
-            for item in items_tag.findall('item'):
-                category_name = item.find('categoryNm').text if item.find('categoryNm') is not None else ''
-                category_code = item.find('categoryCode').text if item.find('categoryCode') is not None else ''
-                if category_name and category_code:
-                    main_categories.append((category_name, category_code))
+        for item in page.items:
+            if item.categoryNm and item.categoryCode:
+                main_categories.append((item.categoryNm, item.categoryCode))
         return main_categories
     except Exception as e:
         st.error(f"농사로 메인 카테고리 로드 오류: {e}")
@@ -289,43 +669,162 @@ def get_nongsaro_middle_categories(main_category_code: str) -> List[Tuple[str, s
     params = {"apiKey": NONGSARO_API_KEY, "categoryCode": main_category_code} # categoryCode는 mainCategoryCode임
     
     try:
-        r = requests.get(url, params=params, timeout=(5, 15))
-        r.raise_for_status()
-        xml_text = r.text
-        root = ET.fromstring(xml_text)
+        page = nongsaro_get_page(url, params, NongsaroMiddleCategory)
         
         middle_categories = [("선택하세요", "")] # 초기 선택 옵션
-        items_tag = root.find('.//items')
-        if items_tag is not None:
-            for item in items_tag.findall('item'):
-                code_name = item.find('codeNm').text if item.find('codeNm') is not None else ''
-                code_value = item.find('code').text if item.find('code') is not None else '' # 미들 카테고리는 'code' 태그 사용
-                
-                # --- 여기에 강화된 숫자 및 불필요한 문자 제거 로직 ---
-                # 모든 숫자 제거 (YYYY년산, YYYY년, 단독 숫자 모두 포함)
-                code_name = re.sub(r'\d+', '', code_name) 
-                
-                # 괄호 안의 내용 제거 (예: "(1234)", "(재배)", "(청주)" 등)
-                code_name = re.sub(r'\s*\(.*\)\s*', '', code_name)
-                
-                # 기타 불필요한 기호나 반복되는 공백 제거
-                code_name = re.sub(r'[^\w\s]', '', code_name) # 알파벳, 한글, 숫자(이미 위에서 제거됨), 공백 외 모두 제거
-                code_name = re.sub(r'\s+', ' ', code_name) # 여러 공백을 하나로 축소
-                
-                code_name = code_name.strip() # 최종적으로 앞뒤 공백 제거
-                
-                if code_name and code_value:
-                    middle_categories.append((code_name, code_value))
+        for item in page.items:
+            # 숫자·괄호·기호 제거 및 공백 정리 (미들 카테고리는 'code' 태그 사용)
+            code_name = clean_category_name(item.codeNm or '')
+            if code_name and item.code:
+                middle_categories.append((code_name, item.code))
         return middle_categories
     except Exception as e:
         st.error(f"농사로 미들 카테고리 로드 오류 (메인:{main_category_code}): {e}")
         return []
 
 # 3) 농사로 (품종정보 - varietyList 사용)
-def nongsaro_info(crop_name: str, category_code: str) -> Optional[str]:
+NONGSARO_VARIETY_URL = "http://api.nongsaro.go.kr/service/varietyInfo/varietyList"
+NONGSARO_PAGE_SIZE = 50   # 페이지당 품종 수
+NONGSARO_MAX_PAGES = 10   # 검색어당 최대 페이지 수 (최대 500개 품종)
+NONGSARO_TOP_K = 5        # 프롬프트에 넣을 상위 품종 수
+
+class NongsaroAPIError(Exception):
+    """농사로 API가 정상(00)이 아닌 resultCode를 반환한 경우 발생합니다."""
+    def __init__(self, result_code: Optional[str], result_msg: Optional[str]):
+        super().__init__(f"resultCode={result_code}, resultMsg={result_msg}")
+        self.result_code = result_code
+        self.result_msg = result_msg
+
+class NongsaroPartialResult(Exception):
+    """
+    일부 페이지를 가져오지 못한 경우 발생합니다. 불완전한 결과가 캐싱되지 않도록 예외로 전달하며,
+    page에는 받은 페이지까지의 결과가 담겨 있습니다.
+    """
+    def __init__(self, page: "NongsaroPage", failed_pages: List[int]):
+        super().__init__(f"누락된 페이지: {failed_pages}")
+        self.page = page
+        self.failed_pages = failed_pages
+
+def _nongsaro_variety_page(category_code: str, svc_code_nm: str, page_no: int, coordinator: Optional[Coordinator] = None) -> NongsaroPage:
+    """varietyList의 한 페이지를 가져옵니다."""
+    params = {
+        "apiKey": NONGSARO_API_KEY,
+        "categoryCode": category_code, # 사용자가 선택한 카테고리 코드 사용
+        "svcCodeNm": svc_code_nm, # 시도할 작물명
+        "numOfRows": NONGSARO_PAGE_SIZE, # 페이지당 결과 수
+        "pageNo": page_no # 페이지 번호
+    }
+    return nongsaro_get_page(NONGSARO_VARIETY_URL, params, NongsaroVariety, coordinator)
+
+@st.cache_data(ttl=3600*24, show_spinner=False) # 24시간 캐싱 (오류 응답은 예외로 전달되어 캐싱되지 않음)
+def fetch_nongsaro_varieties(category_code: str, svc_code_nm: str) -> NongsaroPage:
+    """
+    varietyList 전체 페이지를 가져옵니다.
+    1페이지로 totalCount를 확인한 뒤 나머지 페이지(최대 NONGSARO_MAX_PAGES)를 동시에 요청합니다.
+    한 페이지라도 실패하면 받은 결과를 NongsaroPartialResult로 전달하여 캐싱하지 않습니다.
+    """
+    coordinator = get_coordinator()
+    first = _nongsaro_variety_page(category_code, svc_code_nm, 1, coordinator)
+    if first.result_code != "00":
+        raise NongsaroAPIError(first.result_code, first.result_msg)
+
+    n_pages = min(math.ceil(first.total_count / NONGSARO_PAGE_SIZE), NONGSARO_MAX_PAGES)
+    if n_pages <= 1:
+        return first
+
+    def fetch(page_no: int) -> Optional[NongsaroPage]:
+        # 작업 스레드에서는 st.* 호출을 하지 않고, 실패한 페이지는 None으로 표시합니다.
+        try:
+            page = _nongsaro_variety_page(category_code, svc_code_nm, page_no, coordinator)
+            return page if page.result_code == "00" else None
+        except (requests.exceptions.RequestException, ET.ParseError, ValueError): # 호출 한도 초과(UpstreamRateLimited) 포함
+            return None
+
+    items = list(first.items)
+    failed_pages = []
+    page_numbers = range(2, n_pages + 1)
+    with ThreadPoolExecutor(max_workers=min(n_pages - 1, 8)) as pool:
+        for page_no, page in zip(page_numbers, pool.map(fetch, page_numbers)): # 페이지 순서 유지
+            if page is None:
+                failed_pages.append(page_no)
+            else:
+                items.extend(page.items)
+    result = first._replace(items=items)
+    if failed_pages:
+        raise NongsaroPartialResult(result, failed_pages)
+    return result
+
+# 질문 → 품종 특성(mainChartrInfo) 관련도 계산용 개념 사전: (질문 트리거, 특성 문구 키워드)
+_NONGSARO_RANK_CONCEPTS = (
+    # 병해충 저항성
+    (("병", "저항", "내병", "바이러스", "역병", "탄저", "시들음", "곰팡이", "해충"),
+     ("저항성", "내병", "병에 강", "복합내병")),
+    # 숙기/재배 시기
+    (("조생", "중생", "만생", "숙기", "시기", "파종", "정식", "봄", "여름", "가을", "겨울", "일찍", "늦게"),
+     ("조생", "중생", "만생", "중만생", "숙기", "봄", "여름", "가을", "겨울", "월 상순", "월 중순", "월 하순")),
+    # 수량
+    (("수량", "수확량", "다수확", "많이"),
+     ("다수확", "수량", "수확량")),
+    # 품질/맛
+    (("맛", "당도", "식미", "품질", "단맛"),
+     ("당도", "식미", "맛", "품질", "Brix", "brix")),
+    # 환경 스트레스 (고온·저온·가뭄·도복 등)
+    (("추위", "더위", "고온", "저온", "가뭄", "도복", "습해", "내한", "내서", "냉해"),
+     ("내한", "내서", "고온", "저온", "내건", "도복", "내습", "냉해")),
+)
+_RE_QUERY_TOKEN = re.compile(r'[0-9A-Za-z가-힣]+')
+_KO_JOSA = ("으로", "에서", "에게", "부터", "까지", "처럼", "보다", "은", "는", "이", "가", "을", "를", "에", "의", "도", "로", "와", "과", "만")
+# 조사를 떼어도 되는 한 글자 어간 (예: "병에" → "병"). 그 외 두 글자 단어("오이" 등)는 그대로 둡니다.
+_SINGLE_SYLLABLE_STEMS = {t for triggers, _ in _NONGSARO_RANK_CONCEPTS for t in triggers if len(t) == 1}
+
+def _query_tokens(question: str) -> List[str]:
+    """질문을 단어로 나누고 끝의 조사를 떼어낸 목록을 만듭니다."""
+    tokens = []
+    for tok in _RE_QUERY_TOKEN.findall(question):
+        for josa in _KO_JOSA:
+            if tok.endswith(josa):
+                stem = tok[:-len(josa)]
+                if len(stem) >= 2 or stem in _SINGLE_SYLLABLE_STEMS:
+                    tok = stem
+                break
+        tokens.append(tok)
+    return list(dict.fromkeys(tokens))
+
+def _trigger_hit(trigger: str, tokens: List[str]) -> bool:
+    """
+    개념 트리거가 질문 단어와 맞는지 확인합니다.
+    한 글자 트리거는 단어 전체이거나 단어의 끝("탄저병", "단맛")일 때만, 여러 글자 트리거는
+    단어의 앞/끝에 올 때 일치로 봅니다. ("병아리콩"은 "병" 개념을 켜지 않음)
+    """
+    if len(trigger) == 1:
+        return any(tok.endswith(trigger) for tok in tokens)
+    return any(tok.startswith(trigger) or tok.endswith(trigger) for tok in tokens)
+
+def rank_nongsaro_varieties(question: str, items: List[NongsaroVariety], top_k: int) -> List[NongsaroVariety]:
+    """
+    질문과의 관련도(개념 일치 2점 + 검색어 일치 1점) 순으로 상위 top_k 품종을 반환합니다.
+    점수가 같으면 농사로 응답 순서를 유지합니다.
+    """
+    if not question:
+        return list(items[:top_k])
+    tokens = _query_tokens(question)
+    terms = [t for t in tokens if len(t) >= 2] # 한 글자 단어는 특성 문구와 직접 비교하지 않음
+    concepts = [doc_terms for triggers, doc_terms in _NONGSARO_RANK_CONCEPTS
+                if any(_trigger_hit(t, tokens) for t in triggers)]
+
+    def score(item: NongsaroVariety) -> int:
+        text = f"{item.svcCodeNm or ''} {item.mainChartrInfo or ''}"
+        s = sum(2 for doc_terms in concepts if any(t in text for t in doc_terms))
+        return s + sum(1 for t in terms if t in text)
+
+    scored = sorted(((score(item), i) for i, item in enumerate(items)), key=lambda x: (-x[0], x[1]))
+    return [items[i] for _, i in scored[:top_k]]
+
+def nongsaro_info(crop_name: str, category_code: str, question: str = "", top_k: int = NONGSARO_TOP_K) -> Optional[str]:
     """
     농사로 품종정보(varietyList)를 검색합니다.
-    사용자가 선택한 category_code와 crop_name을 사용합니다.
+    사용자가 선택한 category_code와 crop_name으로 전체 페이지를 가져온 뒤,
+    question과의 관련도 순으로 상위 top_k 품종만 반환합니다.
     """
     if not NONGSARO_API_KEY:
         st.error("NONGSARO_API_KEY가 설정되지 않았습니다. .streamlit/secrets.toml을 확인하세요.")
@@ -367,53 +866,36 @@ def nongsaro_info(crop_name: str, category_code: str) -> Optional[str]:
     search_names_attempts = list(dict.fromkeys(search_names_attempts)) # 중복 제거 (순서 유지)
 
 
-    # 농사로 API URL (품종정보 varietyList)
-    url = "http://api.nongsaro.go.kr/service/varietyInfo/varietyList" 
-    
     for attempt_name in search_names_attempts:
-        params = {
-            "apiKey": NONGSARO_API_KEY,
-            "categoryCode": category_code, # 사용자가 선택한 카테고리 코드 사용
-            "svcCodeNm": attempt_name, # 시도할 작물명
-            "numOfRows": 10, # 검색 결과 수
-            "pageNo": 1 # 페이지 번호
-        }
-        
         try:
-            r = requests.get(url, params=params, timeout=(5, 15))
-            r.raise_for_status() 
-            
-            xml_text = r.text
-            root = ET.fromstring(xml_text)
-            header_tag = root.find('header')
-            result_code = header_tag.find('resultCode').text if header_tag is not None else None
-            result_msg = header_tag.find('resultMsg').text if header_tag is not None else None
-
-            if result_code == "00": # 결과 코드가 정상이면 데이터 유무 확인
-                items_tag = root.find('.//items')
-                total_count_tag = items_tag.find('totalCount') if items_tag is not None else None
-                total_count = int(total_count_tag.text) if total_count_tag is not None and total_count_tag.text.isdigit() else 0
-
-                if total_count > 0: # 데이터 발견 시
-                    texts = []
-                    for item in items_tag.findall('item'):
-                        svc_code_nm = item.find('svcCodeNm').text if item.find('svcCodeNm') is not None else 'N/A'
-                        main_chartr_info = item.find('mainChartrInfo').text if item.find('mainChartrInfo') is not None else '정보 없음'
-                        texts.append(f"[{svc_code_nm}] 주요특성: {main_chartr_info}")
-                    
-                    found_text = "\n\n".join(texts).strip()
-                    return found_text 
-                # else: totalCount가 0인 경우, 다음 시도로 넘어감
-            else: # API 오류 응답
-                error_details = f"농사로 API 응답 오류 (XML): 코드={result_code}, 메시지={result_msg} (시도: '{attempt_name}', 카테고리: '{category_code}', URL: {url})"
-                if result_code == "11": error_details += " - 인증키 문제."
-                elif result_code == "13": error_details += " - 유효한 요청 주소/파라미터가 아님."
-                elif result_code == "15": error_details += " - 도메인 미등록 오류."
-                elif result_code == "91": error_details += " - 농사로 시스템 오류."
-                st.error(error_details)
-                continue # 다음 시도로 넘어감
+            try:
+                page = fetch_nongsaro_varieties(category_code, attempt_name)
+            except NongsaroPartialResult as pr: # 일부 페이지 누락: 캐싱되지 않은 결과를 이번 답변에만 사용
+                page = pr.page
+            if page.total_count > 0 and page.items: # 데이터 발견 시
+                # 조회된 품종 중 질문과 관련도가 높은 상위 top_k 품종만 프롬프트에 전달
+                # (페이지 상한이나 일부 페이지 실패로 조회 수가 totalCount보다 적을 수 있음)
+                ranked = rank_nongsaro_varieties(question, page.items, top_k)
+                texts = [f"(전체 {page.total_count}개 품종 중 조회된 {len(page.items)}개에서 질문 관련도 상위 {len(ranked)}개)"]
+                texts += [
+                    f"[{item.svcCodeNm or 'N/A'}] 주요특성: {item.mainChartrInfo or '정보 없음'}"
+                    for item in ranked
+                ]
+                
+                found_text = "\n\n".join(texts).strip()
+                return found_text 
+            # else: totalCount가 0인 경우, 다음 시도로 넘어감
+        except NongsaroAPIError as ae: # API 오류 응답
+            result_code = ae.result_code
+            error_details = f"농사로 API 응답 오류 (XML): 코드={result_code}, 메시지={ae.result_msg} (시도: '{attempt_name}', 카테고리: '{category_code}', URL: {NONGSARO_VARIETY_URL})"
+            if result_code == "11": error_details += " - 인증키 문제."
+            elif result_code == "13": error_details += " - 유효한 요청 주소/파라미터가 아님."
+            elif result_code == "15": error_details += " - 도메인 미등록 오류."
+            elif result_code == "91": error_details += " - 농사로 시스템 오류."
+            st.error(error_details)
+            continue # 다음 시도로 넘어감
         except ET.ParseError as pe: # XML 파싱 오류 처리
-            st.error(f"농사로 응답 XML 파싱 실패: {pe}. 응답 텍스트 (부분): {xml_text[:500]}...")
+            st.error(f"농사로 응답 XML 파싱 실패: {pe}. (시도: '{attempt_name}', 카테고리: '{category_code}')")
             continue # 다음 시도로 넘어감
         except requests.exceptions.RequestException as re:
             st.error(f"농사로 API 요청 오류: {re}. URL 또는 네트워크 연결을 확인하세요.")
@@ -457,37 +939,188 @@ def rda_general_weather(lat: float, lon: float) -> Optional[dict]:
         return None
 
 # 6) 농업기상 상세 관측데이터 조회
-def rda_detailed_weather(station_id: str) -> Optional[dict]:
-    """농진청 농업기상 상세 관측데이터를 가져옵니다. (예시 함수, 실제 API 파라미터 확인 필요)"""
-    if not RDAD_WEATHER_API_KEY: return None
+@st.cache_data(ttl=600, show_spinner=False) # 지점별 관측값 10분 캐싱 (요청 오류는 예외로 전달되어 캐싱되지 않음)
+def _rda_detailed_weather_cached(station_id: str) -> dict:
     url = f"https://apis.data.go.kr/1390802/AgriWeather/WeatherObsrInfo/V4/InsttWeather/{station_id}"
     params = {
         "serviceKey": RDAD_WEATHER_API_KEY,
         "dataType": "JSON",
     }
-    try:
+    def fetch() -> dict:
         r = requests.get(url, params=params, timeout=(5, 15))
         r.raise_for_status()
         return r.json()
+
+    return get_coordinator().call("rda", request_key(url, params), fetch)
+
+def rda_detailed_weather(station_id: str) -> Optional[dict]:
+    """농진청 농업기상 상세 관측데이터를 가져옵니다. (예시 함수, 실제 API 파라미터 확인 필요)"""
+    if not RDAD_WEATHER_API_KEY or not station_id: return None
+    try:
+        return _rda_detailed_weather_cached(station_id)
     except requests.exceptions.RequestException as e:
         st.error(f"농진청 날씨 API 호출 오류 (상세 관측): {e}")
         return None
 
+# 7) 농업기상 관측지점 인덱스 (사용자 위치 → 최근접 관측지점)
+# 지점 목록은 디스크(.cache/)에 1주간 보관하고, 격자 버킷 인덱스는 세션 간에 공유합니다.
+RDA_STATION_LIST_URL = "https://apis.data.go.kr/1390802/AgriWeather/WeatherObsrInfo/V3/GnrlWeather/getWeatherStationList" # 실제 오퍼레이션명 확인 필요
+RDA_STATION_CACHE_PATH = os.path.join(os.getcwd(), ".cache", "rda_stations.json")
+RDA_STATION_CACHE_TTL = 3600*24*7 # 1주
+RDA_STATION_RETRY_SEC = 300 # 지점 목록 로드 실패 후 재시도까지 RDA 툴을 건너뛰는 시간
+# 지점 목록 로드 실패로 취급하는 예외 (응답 구조가 예상과 다른 경우 포함)
+_RDA_LOAD_ERRORS = (requests.exceptions.RequestException, ValueError, AttributeError, TypeError)
+
+class RdaStation(NamedTuple):
+    code: str
+    name: str
+    lat: float
+    lon: float
+
+def data_go_kr_items(payload) -> list:
+    """
+    data.go.kr JSON 응답에서 response.body.items.item을 목록으로 꺼냅니다.
+    빈 결과("items": "")나 항목이 1개여서 dict로 내려오는 경우도 처리합니다.
+    """
+    node = payload
+    for key in ("response", "body", "items", "item"):
+        node = node.get(key) if isinstance(node, dict) else None
+    if isinstance(node, dict):
+        return [node]
+    return node if isinstance(node, list) else []
+
+def _pick(item: dict, *keys: str):
+    """응답 항목에서 후보 키 중 처음으로 값이 있는 필드를 반환합니다."""
+    for key in keys:
+        if item.get(key) not in (None, ""):
+            return item[key]
+    return None
+
+def fetch_rda_stations() -> List[RdaStation]:
+    """농진청 농업기상 관측지점 목록(지점코드/지점명/위경도)을 가져옵니다."""
+    params = {
+        "serviceKey": RDA_WEATHER_API_KEY,
+        "dataType": "JSON",
+        "numOfRows": "1000",
+        "pageNo": "1",
+    }
+    def fetch() -> dict:
+        r = requests.get(RDA_STATION_LIST_URL, params=params, timeout=(5, 15))
+        r.raise_for_status()
+        return r.json()
+
+    payload = get_coordinator().call("rda", request_key(RDA_STATION_LIST_URL, params), fetch)
+    stations = []
+    for it in data_go_kr_items(payload):
+        if not isinstance(it, dict):
+            continue
+        code = _pick(it, "stn_Code", "obsr_Spot_Code", "stationCode", "stn_Cd")
+        lat = _pick(it, "stn_Lat", "lat", "latitude", "la")
+        lon = _pick(it, "stn_Lon", "lon", "longitude", "lo")
+        if code is None or lat is None or lon is None:
+            continue
+        try:
+            stations.append(RdaStation(str(code), str(_pick(it, "stn_Name", "obsr_Spot_Nm", "stationName") or code), float(lat), float(lon)))
+        except (ValueError, TypeError):
+            continue
+    return stations
+
+def _load_rda_station_cache(max_age: Optional[float]) -> Optional[List[RdaStation]]:
+    """디스크 캐시에서 지점 목록을 읽습니다. max_age가 None이면 오래된 캐시도 허용합니다."""
+    try:
+        if max_age is not None and time.time() - os.path.getmtime(RDA_STATION_CACHE_PATH) > max_age:
+            return None
+        with open(RDA_STATION_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return [RdaStation(*row) for row in json.load(f)] or None
+    except (OSError, ValueError, TypeError):
+        return None
+
+def _save_rda_station_cache(stations: List[RdaStation]) -> None:
+    try:
+        os.makedirs(os.path.dirname(RDA_STATION_CACHE_PATH), exist_ok=True)
+        tmp_path = RDA_STATION_CACHE_PATH + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([list(s) for s in stations], f, ensure_ascii=False)
+        os.replace(tmp_path, RDA_STATION_CACHE_PATH) # 동시 실행 세션이 반쯤 쓴 파일을 읽지 않도록 원자적 교체
+    except OSError:
+        pass # 캐시 저장 실패는 무시 (다음 실행 시 다시 받아옴)
+
+@st.cache_resource(ttl=RDA_STATION_CACHE_TTL, show_spinner=False) # 인덱스는 모든 세션이 공유
+def get_rda_station_index() -> LatLonGridIndex:
+    """관측지점 인덱스를 만듭니다. 디스크 캐시 → API → 만료된 디스크 캐시 순으로 지점 목록을 구합니다."""
+    stations = _load_rda_station_cache(RDA_STATION_CACHE_TTL)
+    if stations is None:
+        try:
+            stations = fetch_rda_stations()
+            if stations:
+                _save_rda_station_cache(stations)
+        except _RDA_LOAD_ERRORS:
+            stations = _load_rda_station_cache(None)
+            if stations is None:
+                raise
+    if not stations:
+        raise ValueError("농진청 관측지점 목록이 비어 있습니다.")
+    return LatLonGridIndex(stations)
+
+@st.cache_resource(show_spinner=False) # 모든 세션이 공유
+def _rda_station_failure() -> dict:
+    """
+    지점 목록 로드 실패를 기억합니다 (negative cache).
+    st.cache_resource는 예외를 캐싱하지 않으므로, 실패 후 RDA_STATION_RETRY_SEC 동안은 재요청하지 않습니다.
+    """
+    return {"until": 0.0}
+
+def rda_nearest_stations(lat: float, lon: float, k: int = 1) -> List[Tuple[float, RdaStation]]:
+    """사용자 위치에서 가장 가까운 농업기상 관측지점 k개를 (거리 km, 지점)으로 반환합니다."""
+    if not RDA_WEATHER_API_KEY: return []
+    failure = _rda_station_failure()
+    if time.time() < failure["until"]:
+        return [] # 최근 로드 실패: 재시도 시각 전까지 RDA 툴 생략
+    try:
+        return get_rda_station_index().nearest(lat, lon, k)
+    except _RDA_LOAD_ERRORS as e:
+        failure["until"] = time.time() + RDA_STATION_RETRY_SEC
+        st.error(f"농진청 관측지점 목록 로드 오류: {e}. {RDA_STATION_RETRY_SEC // 60}분 후 다시 시도합니다.")
+        return []
+
+def rda_nearest_weather(lat: float, lon: float) -> Optional[dict]:
+    """최근접 관측지점의 상세 관측데이터를 가져옵니다."""
+    nearest = rda_nearest_stations(lat, lon, k=1)
+    if not nearest: return None
+    distance_km, station = nearest[0]
+    obs = rda_detailed_weather(station.code)
+    if not obs: return None
+    return {"station": station._asdict(), "distance_km": round(distance_km, 1), "obs": obs}
+
 # ---------------------- OpenAI Chat ----------------------
 def ask_openai(messages: List[dict]) -> Optional[str]:
-    """OpenAI GPT 모델에 질문하고 답변을 받습니다."""
+    """
+    OpenAI GPT 모델에 질문하고 답변을 받습니다.
+    동일한 프롬프트가 이미 진행 중이면 그 답변을 공유하고, 실제 호출은 사용자별 공정 대기열을 거칩니다.
+    """
     if not OPENAI_API_KEY:
         st.error("OPENAI_API_KEY가 없습니다. .streamlit/secrets.toml을 확인하세요.")
         return None
+    coordinator = get_coordinator()
+    user_id = current_user_id()
+
+    def complete() -> str:
+        with coordinator.openai_queue.slot(user_id, OPENAI_QUEUE_WAIT_SEC):
+            from openai import OpenAI
+            client = OpenAI(api_key=OPENAI_API_KEY)
+            resp = client.chat.completions.create(
+                model="gpt-5-mini",
+                messages=messages,
+                #temperature=0.2, # 답변의 일관성과 정확성을 위해 낮은 온도 사용 (자유로운 답변은 프롬프트로 유도)
+            )
+            return resp.choices[0].message.content
+
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        resp = client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=messages,
-            #temperature=0.2, # 답변의 일관성과 정확성을 위해 낮은 온도 사용 (자유로운 답변은 프롬프트로 유도)
-        )
-        return resp.choices[0].message.content
+        prompt_key = hashlib.sha1(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+        return coordinator.call("openai", prompt_key, complete)
+    except UpstreamRateLimited as e: # 호출 한도 초과 또는 대기열 시간 초과
+        st.warning(f"요청이 많아 답변을 생성하지 못했습니다 ({e}). 잠시 후 다시 시도해주세요.")
+        return None
     except Exception as e:
         st.error(f"OpenAI 호출 오류: {e}. API 키 또는 네트워크를 확인하세요.")
         return None
@@ -502,6 +1135,8 @@ with st.sidebar:
     use_plantid   = st.toggle("Plant.ID 이미지 진단", value=True, help="업로드된 이미지로 식물/질병 진단")
     use_nongsaro  = st.toggle("농사로 재배정보", value=True, help="작물명 검색 시 정보 제공") # 농사로 기본값 True
     use_smartfarm = st.toggle("스마트팜 코리아", value=False)
+    # 관측지점 목록 오퍼레이션(RDA_STATION_LIST_URL)이 검증되기 전까지 기본값은 꺼둠
+    use_rda       = st.toggle("농진청 농업기상 (RDA)", value=False, help="가장 가까운 농업기상 관측지점의 상세 관측값 (시험 기능)")
     
     st.caption("불안정하면 끄고 텍스트+이미지 질문만으로도 작동합니다.")
 
@@ -513,23 +1148,35 @@ with st.sidebar:
     lat = None
     lon = None
     city_name = "알 수 없음"
+    location_is_default = False # GPS 실패로 기본 좌표(청주)를 쓰는 경우 True
 
     if use_auto_location:
         location = streamlit_geolocation()
-        if location:
+        if location and location.get('latitude') is not None:
             lat = location['latitude']
             lon = location['longitude']
+            st.session_state.gps_location = (lat, lon) # 재실행 시 컴포넌트 값이 비어도 재사용
             st.info(f"브라우저 GPS로 감지된 위치 (위도: {lat}, 경도: {lon})")
+        elif st.session_state.get("gps_location"):
+            lat, lon = st.session_state.gps_location
+            st.info(f"이전에 감지된 위치 사용 (위도: {lat}, 경도: {lon})")
         else:
             st.warning("자동 위치 감지 실패. 기본 위치를 사용하거나 수동으로 입력해주세요.")
             lat = 36.628956 # 청주 기본값
             lon = 127.462127 # 청주 기본값
             city_name = "청주 (기본값)"
+            location_is_default = True
     else:
         st.markdown("**수동 위치 입력**")
         lat = st.number_input("위도", value=36.628956, format="%.6f", help="날씨 정보를 가져올 위치의 위도")
         lon = st.number_input("경도", value=127.462127, format="%.6f", help="날씨 정보를 가져올 위치의 경도")
         city_name = "수동 입력 위치"
+
+    # 좌표 → 시군구/KMA 격자 (세션 단위 메모이즈, 네트워크 호출 없음)
+    location_info = resolve_location(lat, lon)
+    if location_info.region:
+        city_name = location_info.city_name + (" (기본값)" if location_is_default else "")
+    st.caption(f"📍 {city_name} · KMA 격자 ({location_info.nx}, {location_info.ny})")
     
 
 
@@ -627,15 +1274,21 @@ with colB:
     qimg_file = st.file_uploader("이미지(선택)", type=["jpg","jpeg","png"], help="진단 및 분석에 활용할 이미지를 업로드하세요.")
 
 # ---------------------- On send ----------------------
+# 사용자별 질문 빈도 제한 (한 세션이 업스트림 한도를 독점하지 않도록)
+if q is not None and not get_coordinator().allow_user(current_user_id()):
+    st.warning("요청이 너무 잦습니다. 잠시 후 다시 시도해주세요.")
+    q = None
+
 if q is not None:
     # 1) 컨텍스트 수집 (옵션 툴 호출)
-    ctx = {"weather": None, "plantid": None, "nongsaro": None, "smartfarm": None}
+    ctx = {"weather": None, "rda": None, "plantid": None, "nongsaro": None, "smartfarm": None}
     status_notes = []
 
     # 날씨 (KMA)
     if use_weather and lat is not None and lon is not None:
-        now_weather = kma_ultra_now(lat, lon)
-        pop_weather = kma_vilage_pop(lat, lon)
+        kma_grid = (location_info.nx, location_info.ny)
+        now_weather = kma_ultra_now(lat, lon, grid=kma_grid)
+        pop_weather = kma_vilage_pop(lat, lon, grid=kma_grid)
         
         if now_weather or pop_weather:
             ctx["weather"] = {
@@ -651,6 +1304,17 @@ if q is not None:
     else:
         status_notes.append("날씨(KMA) 비활성화")
 
+    # 농업기상 (RDA) - 최근접 관측지점 상세 관측
+    if use_rda and lat is not None and lon is not None:
+        rda = rda_nearest_weather(lat, lon)
+        if rda:
+            ctx["rda"] = rda
+            status_notes.append(f"농업기상(RDA) OK ({rda['station']['name']})")
+        else:
+            status_notes.append("농업기상(RDA) 불가")
+    elif use_rda:
+        status_notes.append("농업기상(RDA) 불가 (좌표 미입력) ❌")
+
 
     # Plant.ID (이미지 업로드 시)
     img_data_url = None
@@ -679,7 +1343,7 @@ if q is not None:
         # selected_nongsaro_crop_info는 사이드바에서 선택된 최종 값 (category_code, crop_name 포함)
         if selected_nongsaro_crop_info and selected_nongsaro_crop_info["crop_name"] and selected_nongsaro_crop_info["category_code"]:
             # 선택된 작물명과 카테고리 코드로 농사로 API 호출
-            txt = nongsaro_info(selected_nongsaro_crop_info["crop_name"], selected_nongsaro_crop_info["category_code"])
+            txt = nongsaro_info(selected_nongsaro_crop_info["crop_name"], selected_nongsaro_crop_info["category_code"], question=q)
             if txt:
                 ctx["nongsaro"] = {"crop": selected_nongsaro_crop_info["crop_name"], "text": txt[:1500]}
                 status_notes.append("농사로 OK")
@@ -711,6 +1375,11 @@ if q is not None:
         "4. **법규 준수**: 농약/약제 사용 시에는 반드시 제품 라벨 및 지역 농업 관련 법규/규정을 준수하도록 안내합니다.\n"
     )
 
+    if location_is_default:
+        sys_prompt += f"\n- 사용자 위치를 확인하지 못해 기본 위치({city_name}) 기준으로 날씨를 조회했습니다. 실제 위치와 다를 수 있음을 감안하세요."
+    elif location_info.region:
+        sys_prompt += f"\n- 사용자 위치: {location_info.city_name} (위도 {lat:.4f}, 경도 {lon:.4f}, KMA 격자 {location_info.nx},{location_info.ny})."
+    
     if ctx["weather"]:
         weather_info = []
         if ctx["weather"].get("T1H"): weather_info.append(f"기온: {ctx['weather']['T1H']}°C")
@@ -727,6 +1396,11 @@ if q is not None:
     else:
         sys_prompt += f"\n- 날씨 정보를 가져오지 못했습니다. 이 정보 없이 답변을 생성해야 합니다."
     
+    if ctx["rda"]:
+        rda_obs = data_go_kr_items(ctx["rda"]["obs"]) or ctx["rda"]["obs"]
+        sys_prompt += (f"\n- 농진청 농업기상 관측값 ({ctx['rda']['station']['name']} 지점, 약 {ctx['rda']['distance_km']}km): "
+                       f"{json.dumps(rda_obs, ensure_ascii=False)[:1000]}")
+    
     if ctx["plantid"] and ctx["plantid"].get("name"):
         sys_prompt += f"\n- 이미지 진단 결과, 작물: '{ctx['plantid']['name']}'."
     if ctx["plantid"] and ctx["plantid"].get("disease"):
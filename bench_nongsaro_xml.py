@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# 농사로 varietyList XML 파서 벤치마크 (기존 fromstring+find 방식 vs iterparse 스트리밍 파서)
+#
+#   python bench_nongsaro_xml.py
+#   python bench_nongsaro_xml.py --items 1000 20000 50000 --repeat 5
+
+import argparse
+import io
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from nongsaro_xml import NongsaroVariety, parse_nongsaro_xml
+
+
+def make_variety_page(n_items: int, info_len: int = 300) -> bytes:
+    """varietyList 응답 형태의 합성 XML 페이지를 만듭니다."""
+    filler = "가" * info_len
+    items = "".join(
+        f"<item><svcCodeNm>품종{i}</svcCodeNm><categoryCode>FC</categoryCode>"
+        f"<mainChartrInfo>내병성 강함, 조생종 {filler} {i}</mainChartrInfo></item>"
+        for i in range(n_items)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><response>'
+        "<header><resultCode>00</resultCode><resultMsg>OK</resultMsg></header>"
+        f"<body><items>{items}<numOfRows>{n_items}</numOfRows><pageNo>1</pageNo>"
+        f"<totalCount>{n_items}</totalCount></items></body></response>"
+    ).encode("utf-8")
+
+
+def old_parse(body: bytes):
+    """기존 nongsaro_info의 파싱 방식 (본문 전체를 str로 디코딩 후 fromstring + 반복 find)."""
+    root = ET.fromstring(body.decode("utf-8"))
+    header_tag = root.find('header')
+    result_code = header_tag.find('resultCode').text if header_tag is not None else None
+    items_tag = root.find('.//items')
+    total_count_tag = items_tag.find('totalCount') if items_tag is not None else None
+    total_count = int(total_count_tag.text) if total_count_tag is not None and total_count_tag.text.isdigit() else 0
+    records = []
+    for item in items_tag.findall('item'):
+        svc_code_nm = item.find('svcCodeNm').text if item.find('svcCodeNm') is not None else None
+        main_chartr_info = item.find('mainChartrInfo').text if item.find('mainChartrInfo') is not None else None
+        records.append((svc_code_nm, main_chartr_info))
+    return result_code, total_count, records
+
+
+def measure(fn, repeat: int):
+    """평균 실행 시간(초)과 tracemalloc 기준 최대 메모리(바이트)를 측정합니다."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="농사로 varietyList XML 파서 벤치마크")
+    parser.add_argument("--items", type=int, nargs="+", default=[1000, 20000], help="페이지당 품종 수")
+    parser.add_argument("--repeat", type=int, default=3, help="시간 측정 반복 횟수")
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'size':>10} {'parser':>12} {'time':>10} {'peak mem':>10}")
+    for n_items in args.items:
+        body = make_variety_page(n_items)
+        new_parse = lambda: parse_nongsaro_xml(io.BytesIO(body), NongsaroVariety)
+
+        page = new_parse()
+        expected = old_parse(body)
+        assert (page.result_code, page.total_count, [tuple(r) for r in page.items]) == expected, "파서 결과 불일치"
+
+        for name, fn in (("fromstring", lambda: old_parse(body)), ("iterparse", new_parse)):
+            elapsed, peak = measure(fn, args.repeat)
+            print(f"{n_items:>8} {len(body) / 2**20:>8.1f}MB {name:>12} {elapsed * 1000:>8.1f}ms {peak / 2**20:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
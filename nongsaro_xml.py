@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# 농사로 XML 스트리밍 파서와 레코드 타입
+#
+# 응답 본문 전체를 str로 디코딩하지 않고 바이트 스트림을 iterparse로 읽으며,
+# <item>을 다 읽을 때마다 레코드로 변환한 뒤 요소를 비워 메모리를 즉시 반환합니다.
+# app.py(st.cache_data가 반환값을 pickle)와 bench_nongsaro_xml.py가 함께 import하도록 별도 모듈로 둡니다.
+
+import codecs
+import re
+import xml.etree.ElementTree as ET
+from typing import Optional, NamedTuple
+
+
+class NongsaroMainCategory(NamedTuple):
+    categoryNm: Optional[str]
+    categoryCode: Optional[str]
+
+class NongsaroMiddleCategory(NamedTuple):
+    codeNm: Optional[str]
+    code: Optional[str]
+
+class NongsaroVariety(NamedTuple):
+    svcCodeNm: Optional[str]
+    mainChartrInfo: Optional[str]
+
+class NongsaroPage(NamedTuple):
+    result_code: Optional[str]
+    result_msg: Optional[str]
+    total_count: int
+    items: list
+
+# 미들 카테고리명 정리용 정규식 (호출마다 재컴파일하지 않도록 모듈 로드 시 1회 컴파일)
+_RE_DIGITS = re.compile(r'\d+')             # 모든 숫자 (YYYY년산, YYYY년, 단독 숫자)
+_RE_PAREN = re.compile(r'\s*\(.*\)\s*')     # 괄호 안의 내용 (예: "(1234)", "(재배)")
+_RE_SYMBOLS = re.compile(r'[^\w\s]')        # 문자/공백 외 기호
+_RE_SPACES = re.compile(r'\s+')             # 반복되는 공백
+
+def clean_category_name(name: str) -> str:
+    """농사로 미들 카테고리명에서 숫자·괄호·기호를 제거하고 공백을 정리합니다."""
+    name = _RE_DIGITS.sub('', name)
+    name = _RE_PAREN.sub('', name)
+    name = _RE_SYMBOLS.sub('', name)
+    name = _RE_SPACES.sub(' ', name)
+    return name.strip()
+
+# expat이 바이트 그대로 처리할 수 있는 인코딩 (그 외 EUC-KR 등은 str 스트림으로 디코딩해서 넘김)
+_RE_XML_ENCODING = re.compile(rb'<\?xml[^>]*?encoding=["\']([A-Za-z0-9._-]+)["\']')
+_XML_NATIVE_ENCODINGS = {"utf-8", "utf8", "us-ascii", "ascii", "iso-8859-1", "latin-1", "latin1", "utf-16"}
+_RE_CHARSET = re.compile(r'charset\s*=\s*["\']?([A-Za-z0-9._-]+)', re.IGNORECASE)
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    """
+    HTTP Content-Type 헤더에 명시된 charset을 반환합니다.
+    (requests의 r.encoding은 charset이 없을 때도 text/*에 ISO-8859-1을 채우므로 직접 파싱합니다.)
+    """
+    m = _RE_CHARSET.search(content_type or "")
+    return m.group(1) if m else None
+
+class _PrefixedStream:
+    """이미 읽은 앞부분(head)을 먼저 돌려준 뒤 나머지 스트림을 이어서 읽는 래퍼입니다."""
+    __slots__ = ("head", "stream")
+
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b""
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+def _xml_source(stream, fallback_encoding: Optional[str] = None):
+    """
+    XML 선언의 encoding(없으면 HTTP 헤더의 charset인 fallback_encoding)을 확인해,
+    expat이 지원하지 않는 멀티바이트 인코딩(EUC-KR 등)이면 점진적으로 디코딩하는 str 스트림으로 감쌉니다.
+    """
+    head = stream.read(256)
+    source = _PrefixedStream(head, stream)
+    m = _RE_XML_ENCODING.search(head)
+    encoding = m.group(1).decode("ascii") if m else fallback_encoding
+    if encoding:
+        encoding = encoding.lower()
+        if encoding not in _XML_NATIVE_ENCODINGS:
+            try:
+                return codecs.getreader(encoding)(source)
+            except LookupError:
+                pass # 알 수 없는 인코딩은 expat의 오류로 처리
+    return source
+
+def parse_nongsaro_xml(source, record_type, fallback_encoding: Optional[str] = None) -> NongsaroPage:
+    """
+    농사로 XML 응답을 스트리밍 방식으로 파싱합니다.
+    source는 파일 형태의 바이트 스트림(예: requests의 r.raw), record_type은 <item> 하위 태그명을
+    필드로 갖는 NamedTuple 클래스입니다. fallback_encoding은 XML 선언에 encoding이 없을 때 쓸
+    HTTP 헤더의 charset입니다.
+    """
+    field_index = {name: i for i, name in enumerate(record_type._fields)}
+    n_fields = len(field_index)
+    make_record = record_type._make
+    result_code = result_msg = None
+    total_count = 0
+    items = []
+    values = [None] * n_fields
+
+    for _, elem in ET.iterparse(_xml_source(source, fallback_encoding), events=("end",)):
+        tag = elem.tag
+        idx = field_index.get(tag)
+        if idx is not None:
+            values[idx] = elem.text
+        elif tag == "item":
+            items.append(make_record(values))
+            values = [None] * n_fields
+            elem.clear()
+        elif tag == "resultCode":
+            result_code = elem.text
+        elif tag == "resultMsg":
+            result_msg = elem.text
+        elif tag == "totalCount":
+            text = (elem.text or "").strip()
+            total_count = int(text) if text.isdigit() else 0
+    return NongsaroPage(result_code, result_msg, total_count, items)